@@ -5,9 +5,13 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
+import asyncio
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from redis import asyncio as aioredis
 from datetime import datetime, timezone
 import os
+import orjson
 from dotenv import load_dotenv
 from typing import Union
 from pydantic import BaseModel
@@ -17,16 +21,37 @@ load_dotenv()
 
 _client = None
 db = None
+redis_client = None
 
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
+redis_url = os.getenv("REDIS_URL")
 
 if database_url and database_name:
-    _client = MongoClient(database_url)
+    # One client for the whole process: a warm, tuned connection pool is
+    # shared across requests instead of paying handshake/server-selection
+    # cost per call.
+    _client = AsyncIOMotorClient(
+        database_url,
+        maxPoolSize=100,
+        minPoolSize=10,
+        maxIdleTimeMS=60000,
+        serverSelectionTimeoutMS=3000,
+        compressors="zstd,snappy,zlib",
+    )
     db = _client[database_name]
 
+if redis_url:
+    redis_client = aioredis.from_url(redis_url)
+
+# Default TTL for cached read-heavy payloads (seconds)
+CACHE_TTL_SECONDS = 300
+# Longer-lived stale copy served while a fresh value is being rebuilt
+CACHE_STALE_TTL_SECONDS = 3600
+_LOCK_TTL_SECONDS = 10
+
 # Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
+async def create_document(collection_name: str, data: Union[BaseModel, dict]):
     """Insert a single document with timestamp"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -40,16 +65,133 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
     data_dict['created_at'] = datetime.now(timezone.utc)
     data_dict['updated_at'] = datetime.now(timezone.utc)
 
-    result = db[collection_name].insert_one(data_dict)
+    result = await db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
-    """Get documents from collection"""
+async def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None, projection: dict = None, stringify_id: bool = False, batch_size: int = None):
+    """Get documents from collection, optionally projecting a subset of fields.
+
+    With stringify_id=True, _id is converted to a string "id" field inside
+    the aggregation pipeline, so the driver never decodes an ObjectId and
+    no per-document rewrite happens in Python.
+    """
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    if not stringify_id:
+        cursor = db[collection_name].find(filter_dict or {}, projection)
+        if limit:
+            cursor = cursor.limit(limit)
+        if batch_size:
+            cursor = cursor.batch_size(batch_size)
+        return await cursor.to_list(length=None)
+
+    cursor = get_documents_cursor(collection_name, filter_dict, limit, projection, batch_size)
+    return await cursor.to_list(length=None)
+
+def get_documents_cursor(collection_name: str, filter_dict: dict = None, limit: int = None, projection: dict = None, batch_size: int = None):
+    """Aggregation cursor with _id stringified server-side.
+
+    Returned directly (not awaited) so callers can stream documents batch
+    by batch instead of materializing the whole result set.
+    """
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
-    
-    cursor = db[collection_name].find(filter_dict or {})
+
+    pipeline = [{"$match": filter_dict or {}}]
     if limit:
-        cursor = cursor.limit(limit)
-    
-    return list(cursor)
+        pipeline.append({"$limit": limit})
+    pipeline.append({"$addFields": {"id": {"$toString": "$_id"}}})
+    project = {"_id": 0}
+    if projection:
+        project.update(projection)
+        project["id"] = 1
+    pipeline.append({"$project": project})
+    if batch_size:
+        return db[collection_name].aggregate(pipeline, batchSize=batch_size)
+    return db[collection_name].aggregate(pipeline)
+
+# Cache helpers (cache-aside). All of them swallow Redis errors so an
+# outage degrades to plain Mongo reads instead of failing requests.
+async def cache_get(key: str):
+    """Get a cached JSON payload; returns None on miss, no Redis, or error"""
+    if redis_client is None:
+        return None
+    try:
+        cached = await redis_client.get(key)
+        if cached is None:
+            return None
+        return orjson.loads(cached)
+    except orjson.JSONDecodeError:
+        # Corrupt value: drop it so the next read repopulates instead of
+        # failing on every hit until the TTL expires.
+        await cache_delete(key)
+        return None
+    except Exception:
+        return None
+
+async def cache_set(key: str, value, ttl: int = CACHE_TTL_SECONDS):
+    """Cache a JSON-serializable payload with a TTL"""
+    if redis_client is None:
+        return
+    try:
+        await redis_client.setex(key, ttl, orjson.dumps(value))
+    except Exception:
+        pass
+
+async def cache_delete(*keys: str):
+    """Invalidate cache entries after a write"""
+    if redis_client is None or not keys:
+        return
+    try:
+        await redis_client.delete(*keys)
+    except Exception:
+        pass
+
+async def cache_get_or_fetch(key: str, fetch):
+    """Cache-aside read with stampede protection.
+
+    On a miss, only the request that wins the Redis lock repopulates the
+    key; the rest briefly poll for the fresh value, then fall back to a
+    longer-lived stale copy, and only hit the database as a last resort.
+    """
+    cached = await cache_get(key)
+    if cached is not None:
+        return cached
+    if redis_client is None:
+        return await fetch()
+
+    try:
+        got_lock = await redis_client.set(f"lock:{key}", "1", nx=True, ex=_LOCK_TTL_SECONDS)
+    except Exception:
+        return await fetch()
+
+    if got_lock:
+        try:
+            value = await fetch()
+            await cache_set(key, value)
+            await cache_set(f"{key}:stale", value, CACHE_STALE_TTL_SECONDS)
+            return value
+        finally:
+            await cache_delete(f"lock:{key}")
+
+    # Another request holds the lock; wait briefly for its result.
+    for _ in range(5):
+        await asyncio.sleep(0.05)
+        cached = await cache_get(key)
+        if cached is not None:
+            return cached
+    stale = await cache_get(f"{key}:stale")
+    if stale is not None:
+        return stale
+    return await fetch()
+
+async def close_connections():
+    """Close the Mongo and Redis clients at application shutdown"""
+    if _client is not None:
+        _client.close()
+    if redis_client is not None:
+        try:
+            await redis_client.aclose()
+        except Exception:
+            pass
@@ -1,28 +1,72 @@
+import hashlib
+import hmac
 import os
+import re
+import time
+from contextlib import asynccontextmanager
+
+import orjson
+from functools import lru_cache
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict
+from typing import List, Literal, Optional
 from bson import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from database import db, redis_client, create_document, get_documents, get_documents_cursor, cache_get, cache_set, cache_get_or_fetch, cache_delete, close_connections
 
-from database import db, create_document, get_documents
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create indexes once at startup so lookup queries use an IXSCAN
+    # instead of a collection scan as the data grows. Failures (Mongo
+    # unreachable, existing data violating a unique constraint) are
+    # logged and tolerated per index so one bad index doesn't stop the
+    # rest from being created and the app still boots.
+    if db is not None:
+        indexes = [
+            ("lesson", "course_id", {}),
+            ("lesson", [("course_id", 1), ("order", 1)], {"unique": True}),
+            ("exercise", "lesson_id", {}),
+            ("exercise", [("lesson_id", 1), ("type", 1)], {}),
+            ("exercise", [("lesson_id", 1), ("prompt", 1)], {"unique": True}),
+            ("course", "code", {"unique": True}),
+            ("user", "username", {"unique": True}),
+        ]
+        for collection, keys, kwargs in indexes:
+            try:
+                await db[collection].create_index(keys, **kwargs)
+            except Exception as e:
+                print(f"⚠️  Index creation failed on {collection} {keys}, continuing without: {str(e)[:200]}")
+    yield
+    await close_connections()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
+# Browsers ignore credentials with a wildcard origin, so credentials are
+# only enabled when an explicit frontend origin is configured. max_age
+# lets browsers cache preflight responses instead of re-sending OPTIONS.
+_frontend_url = os.getenv("FRONTEND_URL")
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
+    allow_origins=[_frontend_url] if _frontend_url else ["*"],
+    allow_credentials=bool(_frontend_url),
+    allow_methods=["GET", "POST"],
     allow_headers=["*"],
+    max_age=86400,
 )
 
 @app.get("/")
 def read_root():
     return {"message": "Language Learning API running"}
 
-@app.get("/test")
-def test_database():
+# Health snapshot for /test: probes are cheap to serve from memory and
+# load balancers can hit this endpoint many times per second.
+_HEALTH_TTL_SECONDS = 5
+_health = {"ts": 0.0, "data": None}
+
+async def _probe_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -38,7 +82,7 @@ def test_database():
             response["database_name"] = db.name if hasattr(db, 'name') else "✅ Connected"
             response["connection_status"] = "Connected"
             try:
-                collections = db.list_collection_names()
+                collections = await db.list_collection_names()
                 response["collections"] = collections[:10]
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
@@ -53,120 +97,265 @@ def test_database():
 
     return response
 
+@app.get("/test")
+async def test_database():
+    if _health["data"] is not None and time.time() - _health["ts"] < _HEALTH_TTL_SECONDS:
+        return _health["data"]
+    _health["data"] = await _probe_database()
+    _health["ts"] = time.time()
+    return _health["data"]
+
 # ---------- Models for requests ----------
 class CreateUserReq(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
     username: str
     name: Optional[str] = None
 
 class CreateCourseReq(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
     name: str
     code: str
     base_language: str = "en"
 
 class CreateLessonReq(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
     course_id: str
     title: str
     order: int
 
 class CreateExerciseReq(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
     lesson_id: str
-    type: str
+    type: Literal["mcq", "translate"]
     prompt: str
     options: Optional[List[str]] = None
     answer: str
 
 class AnswerReq(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
     exercise_id: str
     answer: str
     user_id: Optional[str] = None
 
 # ---------- Helper ----------
+_OID_RE = re.compile(r"^[0-9a-fA-F]{24}$")
+
+@lru_cache(maxsize=4096)
+def _oid_cached(id_str: str) -> ObjectId:
+    return ObjectId(id_str)
+
 def oid(id_str: str) -> ObjectId:
+    # Regex prefilter avoids the exception raise/catch cost of handing
+    # malformed input to the ObjectId constructor. fullmatch, not match:
+    # $ would accept a trailing newline that ObjectId then rejects.
+    if not _OID_RE.fullmatch(id_str):
+        raise HTTPException(status_code=400, detail="Invalid id")
     try:
-        return ObjectId(id_str)
+        return _oid_cached(id_str)
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid id")
 
+def _answer_hash(answer: str) -> bytes:
+    return hashlib.sha1(answer.strip().lower().encode()).digest()
+
+async def _set_answer_hash(exercise_id: str, answer: str):
+    if redis_client is None:
+        return
+    try:
+        await redis_client.set(f"ex:{exercise_id}:ans", _answer_hash(answer))
+    except Exception:
+        pass
+
 # ---------- Endpoints ----------
 @app.post("/api/users")
-def create_user(payload: CreateUserReq):
+async def create_user(payload: CreateUserReq):
     user = {
         "username": payload.username,
         "name": payload.name,
         "xp": 0,
         "streak": 0,
     }
-    user_id = db["user"].insert_one(user).inserted_id
+    try:
+        user_id = (await db["user"].insert_one(user)).inserted_id
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Username already exists")
     return {"id": str(user_id), **user}
 
 @app.get("/api/courses")
-def list_courses():
-    items = get_documents("course")
-    for doc in items:
-        doc["id"] = str(doc.pop("_id"))
-    return items
+async def list_courses():
+    async def fetch():
+        return await get_documents("course", projection={"name": 1, "code": 1, "base_language": 1}, stringify_id=True, batch_size=50)
+    return await cache_get_or_fetch("courses:all", fetch)
 
 @app.post("/api/courses")
-def create_course(payload: CreateCourseReq):
-    course_id = create_document("course", payload.model_dump())
-    return {"id": course_id, **payload.model_dump()}
+async def create_course(payload: CreateCourseReq):
+    data = payload.model_dump()
+    try:
+        data["id"] = await create_document("course", data)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Course code already exists")
+    await cache_delete("courses:all", "courses:all:stale")
+    return data
 
 @app.get("/api/courses/{course_id}/lessons")
-def list_lessons(course_id: str):
-    items = get_documents("lesson", {"course_id": course_id})
-    for doc in items:
-        doc["id"] = str(doc.pop("_id"))
-    return items
+async def list_lessons(course_id: str):
+    async def fetch():
+        return await get_documents("lesson", {"course_id": oid(course_id)}, projection={"course_id": {"$toString": "$course_id"}, "title": 1, "order": 1}, stringify_id=True, batch_size=200)
+    return await cache_get_or_fetch(f"lessons:{course_id}", fetch)
 
 @app.post("/api/lessons")
-def create_lesson(payload: CreateLessonReq):
-    lesson_id = create_document("lesson", payload.model_dump())
-    return {"id": lesson_id, **payload.model_dump()}
+async def create_lesson(payload: CreateLessonReq):
+    data = payload.model_dump()
+    # Stored as a native ObjectId: 12 bytes in the index vs 24-char hex
+    data["course_id"] = oid(payload.course_id)
+    try:
+        data["id"] = await create_document("lesson", data)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Lesson order already exists for this course")
+    data["course_id"] = payload.course_id
+    await cache_delete(f"lessons:{payload.course_id}", f"lessons:{payload.course_id}:stale")
+    return data
+
+# Streamed results are only cached below this document count so peak
+# memory stays bounded by the driver batch size for oversized lessons.
+_STREAM_CACHE_MAX_DOCS = 1000
 
 @app.get("/api/lessons/{lesson_id}/exercises")
-def list_exercises(lesson_id: str):
-    items = get_documents("exercise", {"lesson_id": lesson_id})
-    for doc in items:
-        doc["id"] = str(doc.pop("_id"))
-    return items
+async def list_exercises(lesson_id: str, type: Optional[Literal["mcq", "translate"]] = None):
+    query = {"lesson_id": oid(lesson_id)}
+    key = f"exercises:{lesson_id}"
+    if type is not None:
+        query["type"] = type
+        key = f"exercises:{lesson_id}:type:{type}"
+    cached = await cache_get(key)
+    if cached is not None:
+        return cached
+
+    cursor = get_documents_cursor("exercise", query, projection={"lesson_id": {"$toString": "$lesson_id"}, "type": 1, "prompt": 1, "options": 1, "answer": 1}, batch_size=200)
+
+    async def gen():
+        yield b"["
+        first = True
+        docs = []
+        async for doc in cursor:
+            if not first:
+                yield b","
+            first = False
+            yield orjson.dumps(doc)
+            if docs is not None:
+                docs.append(doc)
+                if len(docs) > _STREAM_CACHE_MAX_DOCS:
+                    docs = None
+        yield b"]"
+        if docs is not None:
+            await cache_set(key, docs)
+    return StreamingResponse(gen(), media_type="application/json")
 
 @app.post("/api/exercises")
-def create_exercise(payload: CreateExerciseReq):
-    if payload.type not in ["mcq", "translate"]:
-        raise HTTPException(status_code=400, detail="Invalid exercise type")
-    exercise_id = create_document("exercise", payload.model_dump())
-    return {"id": exercise_id, **payload.model_dump()}
+async def create_exercise(payload: CreateExerciseReq):
+    data = payload.model_dump()
+    data["lesson_id"] = oid(payload.lesson_id)
+    # Normalized once at write time so the answer hot path never has to
+    data["answer_norm"] = payload.answer.strip().lower()
+    try:
+        data["id"] = await create_document("exercise", data)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Exercise prompt already exists for this lesson")
+    data["lesson_id"] = payload.lesson_id
+    del data["answer_norm"]
+    await cache_delete(
+        f"exercises:{payload.lesson_id}",
+        f"exercises:{payload.lesson_id}:stale",
+        f"exercises:{payload.lesson_id}:type:{payload.type}",
+        f"exercises:{payload.lesson_id}:type:{payload.type}:stale",
+    )
+    await _set_answer_hash(data["id"], payload.answer)
+    return data
 
 @app.post("/api/answer")
-def submit_answer(payload: AnswerReq):
-    ex = db["exercise"].find_one({"_id": oid(payload.exercise_id)})
+async def submit_answer(payload: AnswerReq):
+    submitted_hash = _answer_hash(str(payload.answer))
+
+    # Hot path: compare against the pre-normalized hash in Redis without
+    # touching Mongo. The expected answer is only fetched when wrong.
+    expected_hash = None
+    if redis_client is not None:
+        try:
+            expected_hash = await redis_client.get(f"ex:{payload.exercise_id}:ans")
+        except Exception:
+            expected_hash = None
+    if expected_hash is not None and hmac.compare_digest(expected_hash, submitted_hash):
+        return {"correct": True}
+
+    ex = await db["exercise"].find_one({"_id": oid(payload.exercise_id)}, {"answer": 1, "answer_norm": 1})
     if not ex:
         raise HTTPException(status_code=404, detail="Exercise not found")
-    correct = str(payload.answer).strip().lower() == str(ex.get("answer", "")).strip().lower()
-    return {"correct": correct, "expected": ex.get("answer")}
+    expected = str(ex.get("answer", ""))
+    # Docs written before answer_norm existed fall back to normalizing here
+    expected_norm = ex.get("answer_norm") or expected.strip().lower()
+    if expected_hash is None:
+        # Redis miss: warm the cache for subsequent submissions.
+        await _set_answer_hash(payload.exercise_id, expected_norm)
+    correct = hmac.compare_digest(submitted_hash, _answer_hash(expected_norm))
+    if correct:
+        return {"correct": True}
+    return {"correct": False, "expected": expected}
 
 # Seed demo content endpoint
 @app.post("/api/seed")
-def seed_demo():
-    # Create a demo course, lesson, and a few exercises if not exist
-    course = db["course"].find_one({"code": "es"})
-    if not course:
-        course_id = db["course"].insert_one({"name": "Spanish", "code": "es", "base_language": "en"}).inserted_id
-    else:
+async def seed_demo():
+    # Idempotent upserts replace the check-then-insert round-trips
+    result = await db["course"].update_one(
+        {"code": "es"},
+        {"$setOnInsert": {"name": "Spanish", "base_language": "en"}},
+        upsert=True,
+    )
+    course_id = result.upserted_id
+    if course_id is None:
+        course = await db["course"].find_one({"code": "es"}, {"_id": 1})
         course_id = course["_id"]
 
-    lesson = db["lesson"].find_one({"course_id": str(course_id), "order": 1})
-    if not lesson:
-        lesson_id = db["lesson"].insert_one({"course_id": str(course_id), "title": "Basics 1", "order": 1}).inserted_id
-    else:
+    result = await db["lesson"].update_one(
+        {"course_id": course_id, "order": 1},
+        {"$setOnInsert": {"title": "Basics 1"}},
+        upsert=True,
+    )
+    lesson_id = result.upserted_id
+    if lesson_id is None:
+        lesson = await db["lesson"].find_one({"course_id": course_id, "order": 1}, {"_id": 1})
         lesson_id = lesson["_id"]
 
-    if db["exercise"].count_documents({"lesson_id": str(lesson_id)}) == 0:
-        exercises = [
-            {"lesson_id": str(lesson_id), "type": "mcq", "prompt": "How do you say 'Hello' in Spanish?", "options": ["Hola", "Adios", "Gracias"], "answer": "Hola"},
-            {"lesson_id": str(lesson_id), "type": "translate", "prompt": "Translate: Gracias", "answer": "Thank you"},
-        ]
-        db["exercise"].insert_many(exercises)
+    exercises = [
+        {"lesson_id": lesson_id, "type": "mcq", "prompt": "How do you say 'Hello' in Spanish?", "options": ["Hola", "Adios", "Gracias"], "answer": "Hola", "answer_norm": "hola"},
+        {"lesson_id": lesson_id, "type": "translate", "prompt": "Translate: Gracias", "answer": "Thank you", "answer_norm": "thank you"},
+    ]
+    try:
+        await db["exercise"].insert_many(exercises, ordered=False, bypass_document_validation=True)
+    except BulkWriteError as exc:
+        # Re-seeds hit the unique (lesson_id, prompt) index; only
+        # duplicate-key errors (11000) are expected and ignorable.
+        if any(err.get("code") != 11000 for err in exc.details.get("writeErrors", [])):
+            raise
+
+    # Seeding writes all three collections, so invalidate like the create
+    # endpoints do — otherwise a pre-seed GET leaves an empty list cached.
+    await cache_delete(
+        "courses:all",
+        "courses:all:stale",
+        f"lessons:{course_id}",
+        f"lessons:{course_id}:stale",
+        f"exercises:{lesson_id}",
+        f"exercises:{lesson_id}:stale",
+        f"exercises:{lesson_id}:type:mcq",
+        f"exercises:{lesson_id}:type:mcq:stale",
+        f"exercises:{lesson_id}:type:translate",
+        f"exercises:{lesson_id}:type:translate:stale",
+    )
 
     return {"seeded": True, "course_id": str(course_id), "lesson_id": str(lesson_id)}
 